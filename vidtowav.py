@@ -1,102 +1,412 @@
 #!/usr/bin/env python
 import os
+import re
 import sys
+import json
+import shutil
 import subprocess
 import time
 import threading
 import queue
-from pathlib import Path
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                            QLabel, QTreeWidget, QTreeWidgetItem, QProgressBar, QTextEdit, 
+                            QLabel, QTreeWidget, QTreeWidgetItem, QProgressBar, QPlainTextEdit, 
                             QPushButton, QCheckBox, QTabWidget, QFileDialog, QMessageBox,
                             QGroupBox, QGridLayout, QSplitter, QComboBox, QButtonGroup, QSlider,
-                            QRadioButton, QStyle)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
-from PyQt5.QtGui import QIcon, QTextCursor, QFont
+                            QRadioButton, QStyle, QSpinBox, QTreeWidgetItemIterator)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QSize
+from PyQt5.QtGui import QIcon, QFont
+
+# En Windows evita que cada proceso de ffmpeg abra una ventana de consola
+CREATE_NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+# En POSIX, con close_fds=False (y ruta absoluta, sin cwd ni preexec_fn) subprocess
+# lanza los procesos con posix_spawn en lugar de fork+exec, sin duplicar la memoria
+# de la aplicación. Los descriptores que crea Python no son heredables (PEP 446),
+# así que ffmpeg solo recibe sus propios pipes. En Windows se mantiene el valor por defecto
+CLOSE_FDS = os.name == 'nt'
+
+# Duración de cada entrada en el registro de ffmpeg ("Duration: 01:02:03.45")
+DURATION_PATTERN = re.compile(rb'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+# Nivel de cada línea con -loglevel level+info; las líneas de un componente llevan
+# delante su contexto ("[mov,mp4,m4a @ 0x55d0] [info] ...")
+LOG_LEVEL_PATTERN = re.compile(rb'^((?:\[[^\]]* @ [^\]]*\] )*)\[(\w+)\] ')
+
+# Conversiones simultáneas por defecto: la mitad de los núcleos, ya que cada
+# proceso de ffmpeg usa además sus propios hilos
+DEFAULT_MAX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Carpetas de sistema o de herramientas que nunca contienen videos del usuario y
+# que no se recorren (en minúsculas; en Windows las de sistema además suelen
+# devolver errores de acceso)
+SKIPPED_FOLDERS = frozenset({
+    '$recycle.bin', 'system volume information', '.git', '.svn', '__pycache__'
+})
+
+
+def iter_video_entries(folder, video_exts, recursive=True, on_error=None):
+    """Recorre una carpeta con os.scandir y genera (carpeta, DirEntry) de cada video.
+    
+    Usa una pila de carpetas en lugar de os.walk para aprovechar la información
+    que ya trae cada DirEntry (tipo y, en Windows, stat sin llamadas extra).
+    video_exts es una tupla de extensiones en minúsculas que empiezan por punto.
+    Los errores al leer una carpeta se pasan a on_error(carpeta, excepción).
+    """
+    pending_dirs = [folder]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    # No seguir enlaces simbólicos a carpetas (igual que os.walk)
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and entry.name.lower() not in SKIPPED_FOLDERS:
+                            pending_dirs.append(entry.path)
+                    elif entry.name.lower().endswith(video_exts) and entry.is_file():
+                        yield current_dir, entry
+        except OSError as e:
+            if on_error:
+                on_error(current_dir, e)
 
 
 class FFmpegWorker(QThread):
     """Hilo de trabajo para la conversión de archivos con ffmpeg"""
     # Señales
     progress_updated = pyqtSignal(int, int)  # Actualizar progreso (actual, total)
+    partial_progress = pyqtSignal(float)  # Fracción convertida de los archivos en curso
     conversion_finished = pyqtSignal()  # Conversión terminada
     log_message = pyqtSignal(str)  # Mensaje de registro
+    log_messages = pyqtSignal(list)  # Varios mensajes de registro en una sola señal
+    
+    # Los mensajes de cada archivo (omitidos, convertidos) se agrupan y se envían
+    # en bloques de como mucho este tamaño: una señal entre hilos por bloque en
+    # lugar de una por archivo
+    LOG_BATCH_LINES = 100
+    
+    # Conversión por lotes: a partir de cuántos archivos se agrupan y tamaño máximo
+    # de cada lote (limita la longitud de la línea de comandos y las entradas que
+    # ffmpeg mantiene abiertas a la vez). Se usan varias entradas con -map en lugar
+    # del demuxer concat: concat exige el mismo codec en todos los archivos y une
+    # el audio en un solo flujo, así que no se podría separar por archivo de origen
+    BATCH_MIN_FILES = 8
+    BATCH_MAX_FILES = 32
+    
+    # Caché de conversiones (en la carpeta de salida) y cada cuántas conversiones se guarda
+    CACHE_FILENAME = '.vidtowav_cache.json'
+    CACHE_SAVE_INTERVAL = 50
+    
+    # Capacidad de la cola entre la búsqueda de archivos y su preparación
+    DISCOVERY_QUEUE_SIZE = 256
+    
+    # Líneas finales de stderr de ffmpeg que se muestran cuando falla una conversión
+    STDERR_TAIL_LINES = 20
+    
+    # Intervalo mínimo (segundos) entre avisos de progreso dentro de los archivos
+    PARTIAL_PROGRESS_INTERVAL = 0.1
+    
+    # Mapeo de formatos a extensiones
+    OUTPUT_EXTENSIONS = {
+        'wav': '.wav',
+        'wav_voice': '.wav',
+        'mp3': '.mp3',
+        'ogg': '.ogg',
+        'flac': '.flac',
+        'aac': '.aac',
+        'm4a': '.m4a',
+        'opus': '.opus',
+        'wma': '.wma'
+    }
+    
+    # Valores de calidad y bitrate por nivel del control (0 = mejor calidad)
+    # MP3 quality: 0 (mejor) a 9 (peor)
+    MP3_QUALITY = {
+        0: '0',  # Mejor calidad
+        1: '2',
+        2: '4',
+        3: '6',
+        4: '9'   # Calidad más baja
+    }
+    # OGG quality: 0 (peor) a 10 (mejor)
+    OGG_QUALITY = {
+        0: '10',  # Mejor calidad
+        1: '8',
+        2: '6',
+        3: '3',
+        4: '1'    # Calidad más baja
+    }
+    AAC_BITRATES = {
+        0: '256k',  # Mejor calidad
+        1: '192k',
+        2: '128k',
+        3: '96k',
+        4: '64k'    # Calidad más baja
+    }
+    OPUS_BITRATES = {
+        0: '192k',  # Mejor calidad
+        1: '128k',
+        2: '96k',
+        3: '64k',
+        4: '32k'    # Calidad más baja
+    }
+    WMA_BITRATES = {
+        0: '256k',  # Mejor calidad
+        1: '192k',
+        2: '128k',
+        3: '96k',
+        4: '64k'    # Calidad más baja
+    }
+    
+    # Copia directa del audio cuando el origen ya está en el formato WAV de destino:
+    # parámetros PCM (codec, frecuencia, canales) de cada formato WAV y contenedores
+    # de video en los que se comprueba (los que suelen llevar audio PCM)
+    PCM_TARGETS = {
+        'wav': ('pcm_s16le', 44100, 2),
+        'wav_voice': ('pcm_s16le', 16000, 1)
+    }
+    PCM_CONTAINERS = ('.avi', '.mov', '.mkv', '.mxf')
+    COPY_CODEC_ARGS = ['-map', '0:a:0', '-c:a', 'copy']
+    PROBE_WORKERS = 4  # Consultas de ffprobe simultáneas dentro de cada lote
     
     def __init__(self, input_path, output_path, selected_items, selected_formats, 
-                 recursive, overwrite_existing, output_format, audio_quality):
+                 recursive, overwrite_existing, output_format, audio_quality, max_workers=None,
+                 ffmpeg_threads=0, skip_unchanged=True, ffmpeg_exe='ffmpeg', ffprobe_exe=None,
+                 prescanned_files=None, skip_newer_outputs=False):
         super().__init__()
         self.input_path = input_path
         self.output_path = output_path
         self.selected_items = selected_items
         self.selected_formats = selected_formats
+        # Las extensiones empiezan por punto, así que endswith equivale a comparar la extensión
+        self.video_exts = tuple(fmt.lower() for fmt in selected_formats)
         self.recursive = recursive
         self.overwrite_existing = overwrite_existing
         self.output_format = output_format
         self.audio_quality = audio_quality
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.ffmpeg_threads = ffmpeg_threads  # 0 = repartir los núcleos entre los procesos
+        self.skip_unchanged = skip_unchanged  # Omitir orígenes ya convertidos que no cambiaron
+        self.skip_newer_outputs = skip_newer_outputs  # Omitir salidas más recientes que su origen
+        self.ffmpeg_exe = ffmpeg_exe  # Ruta absoluta resuelta una sola vez
+        self.ffprobe_exe = ffprobe_exe  # None = ffprobe no disponible
+        # Videos ya encontrados al construir el árbol (None = recorrer las carpetas)
+        self.prescanned_files = prescanned_files
+        
+        # Los parámetros de codec no cambian durante la conversión: se calculan una vez
+        self.codec_args = self.get_codec_args()
+        self.codec_args_key = ' '.join(self.codec_args)  # Identifica los parámetros en la caché
+        
+        # Prefijo normalizado de la carpeta de entrada, para obtener la ruta relativa
+        # de cada archivo con una comparación de texto en lugar de os.path.relpath
+        self.input_prefix = os.path.join(os.path.normcase(os.path.abspath(input_path)), '')
         self.stop_requested = False
+        
+        # Salidas existentes que se vuelven a convertir sin sobrescribir las demás,
+        # porque su origen cambió desde la última conversión (rutas normalizadas)
+        self.replaced_outputs = set()
+        
+        # Procesos ffmpeg en marcha, para interrumpirlos al detener la conversión
+        self.process_lock = threading.Lock()
+        self.processes = set()
+        
+        # Progreso parcial de cada proceso ffmpeg en curso (por hilo del pool)
+        self.progress_lock = threading.Lock()
+        self.partial_fractions = {}
+        self.last_partial_emit = 0.0
     
     def run(self):
         # Buscar archivos de video
         self.log_message.emit(f"🔍 Buscando archivos de video en: {self.input_path}")
         self.log_message.emit(f"Formatos seleccionados: {', '.join(self.selected_formats)}")
         
-        video_files = self.find_video_files()
-        
-        if not video_files:
-            self.log_message.emit("ℹ️ No se encontraron archivos de video en las carpetas seleccionadas.")
-            self.conversion_finished.emit()
-            return
-        
-        self.log_message.emit(f"✅ Se encontraron {len(video_files)} archivos de video.")
-        self.log_message.emit(f"Formato de salida: {self.output_format}")
-        
         # Contadores
         successful = 0
         failed = 0
         skipped = 0
-        total_files = len(video_files)
-        
-        # Convertir archivos
-        self.log_message.emit("🚀 Iniciando conversión...")
-        for i, video_file in enumerate(video_files):
-            if self.stop_requested:
-                self.log_message.emit("⚠️ Proceso de conversión detenido por el usuario.")
+        processed = 0
+        total_files = 0
+        
+        # Un hilo productor recorre las carpetas y entrega los videos por una cola
+        # acotada mientras este hilo va preparando cada archivo (ruta de salida,
+        # caché y comprobación de existencia), solapando ambas fases de E/S
+        output_extension = self.get_output_extension()
+        existing_outputs = None if self.overwrite_existing else self.find_existing_outputs(output_extension)
+        conversion_cache = self.load_conversion_cache()
+        video_queue = queue.Queue(maxsize=self.DISCOVERY_QUEUE_SIZE)
+        producer = threading.Thread(target=self.produce_video_files, args=(video_queue,), daemon=True)
+        producer.start()
+        
+        # Determinar todas las rutas de salida y crear los directorios antes de lanzar
+        # los procesos, para que los hilos no compitan creando las mismas carpetas
+        cache_entries = {}
+        output_dirs = set()
+        queued_outputs = set()
+        pending = []
+        skip_messages = []
+        while True:
+            item = video_queue.get()
+            if item is None:
                 break
-                
-            # Determinar la ruta de salida
-            output_extension = self.get_output_extension()
             
-            if not self.output_path:
-                # Si no se especificó carpeta de salida, usar la misma que el archivo original
-                output_file = video_file.with_suffix(output_extension)
-            else:
-                # Calcular ruta de salida preservando la estructura de carpetas
-                rel_path = video_file.relative_to(self.input_path) if video_file.is_relative_to(self.input_path) else Path(video_file.name)
-                output_file = Path(self.output_path) / rel_path.with_suffix(output_extension)
-                
-                # Crear directorio de salida si no existe
-                os.makedirs(output_file.parent, exist_ok=True)
+            video_file, stat = item
+            total_files += 1
+            output_file = self.get_output_file(video_file, output_extension)
+            cache_key = os.path.normcase(video_file)
+            cache_entry = self.get_cache_entry(video_file, output_file, stat)
+            output_key = os.path.normcase(output_file)
             
+            # Dos videos pueden dar la misma salida (a.mp4 y a.mkv -> a.wav); se convierte
+            # solo el primero para que el segundo no lo sobrescriba en la misma ejecución
+            if output_key in queued_outputs:
+                skip_messages.append(f"⏭️ Omitido: {os.path.basename(video_file)} "
+                                     f"(La salida coincide con la de otro archivo: {os.path.basename(output_file)})")
+                skipped += 1
+            # Sin sobrescribir, omitir los archivos ya convertidos con los mismos parámetros
+            # que no han cambiado (la existencia de la salida se mira en la lista ya leída).
+            # Al sobrescribir se vuelven a convertir todos, como pide esa opción
+            elif (self.skip_unchanged and existing_outputs is not None and cache_entry
+                    and conversion_cache.get(cache_key) == cache_entry and output_key in existing_outputs):
+                skip_messages.append(f"⏭️ Omitido: {os.path.basename(video_file)} (Sin cambios desde la última conversión)")
+                skipped += 1
+            # Si la caché registra que esta salida se escribió desde una versión anterior
+            # del origen (u otros parámetros), se vuelve a convertir aunque ya exista
+            elif (self.skip_unchanged and existing_outputs is not None and cache_entry
+                    and output_key in existing_outputs
+                    and self.is_cache_entry_stale(conversion_cache.get(cache_key), cache_entry)):
+                skip_messages.append(f"♻️ {os.path.basename(video_file)}: cambió desde la última conversión, se volverá a convertir")
+                self.replaced_outputs.add(output_key)
+                pending.append((video_file, output_file))
+                queued_outputs.add(output_key)
+                cache_entries[video_file] = (cache_key, cache_entry)
+                output_dirs.add(os.path.dirname(output_file))
             # Verificar si el archivo de salida ya existe
-            if output_file.exists() and not self.overwrite_existing:
-                self.log_message.emit(f"⏭️ Omitido: {video_file.name} (Ya existe)")
+            elif existing_outputs is not None and output_key in existing_outputs:
+                skip_messages.append(f"⏭️ Omitido: {os.path.basename(video_file)} (Ya existe)")
+                skipped += 1
+            # Al sobrescribir, omitir las salidas escritas después de la última modificación
+            # del original aunque no estén en la caché (p. ej. de otra carpeta de salida)
+            elif self.skip_newer_outputs and cache_entry and self.is_output_newer(output_file, cache_entry):
+                skip_messages.append(f"⏭️ Omitido: {os.path.basename(video_file)} (La salida es más reciente que el original)")
                 skipped += 1
             else:
-                self.log_message.emit(f"🔄 Convirtiendo: {video_file.name}")
-                success = self.convert_audio(str(video_file), str(output_file))
-                
-                if success:
-                    self.log_message.emit(f"✅ Convertido: {video_file.name}")
-                    successful += 1
-                else:
-                    failed += 1
+                pending.append((video_file, output_file))
+                queued_outputs.add(output_key)
+                cache_entries[video_file] = (cache_key, cache_entry)
+                output_dirs.add(os.path.dirname(output_file))
+            
+            if len(skip_messages) >= self.LOG_BATCH_LINES:
+                self.log_messages.emit(skip_messages)
+                skip_messages = []
+        
+        producer.join()
+        if skip_messages:
+            self.log_messages.emit(skip_messages)
+        
+        if self.stop_requested:
+            self.log_message.emit("⚠️ Proceso de conversión detenido por el usuario.")
+            self.conversion_finished.emit()
+            return
+        
+        if not total_files:
+            self.log_message.emit("ℹ️ No se encontraron archivos de video en las carpetas seleccionadas.")
+            self.conversion_finished.emit()
+            return
+        
+        self.log_message.emit(f"✅ Se encontraron {total_files} archivos de video.")
+        self.log_message.emit(f"Formato de salida: {self.output_format}")
+        
+        # Los archivos omitidos cuentan como procesados
+        processed = skipped
+        self.progress_updated.emit(processed, total_files)
+        
+        # Crear cada directorio de salida una sola vez, los más profundos primero:
+        # makedirs ya crea sus carpetas padre, que no hace falta volver a comprobar
+        created_dirs = set()
+        for output_dir in sorted(output_dirs, reverse=True):
+            if output_dir in created_dirs:
+                continue
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+            except OSError as e:
+                self.log_message.emit(f"⚠️ No se pudo crear la carpeta de salida {output_dir}: {str(e)}")
+                continue
             
-            # Actualizar progreso
-            self.progress_updated.emit(i + 1, total_files)
+            while output_dir and output_dir not in created_dirs:
+                created_dirs.add(output_dir)
+                parent_dir = os.path.dirname(output_dir)
+                if parent_dir == output_dir:
+                    break
+                output_dir = parent_dir
+        
+        # Convertir primero los archivos más grandes para que los pequeños rellenen
+        # los huecos al final y ningún proceso quede solo con un archivo enorme
+        pending.sort(key=lambda pair: self.get_source_size(cache_entries[pair[0]][1]), reverse=True)
+        
+        # Agrupar los archivos en lotes para amortizar el arranque de ffmpeg;
+        # con pocos archivos se convierte uno por proceso. Los archivos se reparten
+        # de forma alterna para que todos los lotes tengan un tamaño total similar
+        batch_size = self.get_batch_size(len(pending))
+        batch_count = -(-len(pending) // batch_size)
+        batches = [pending[i::batch_count] for i in range(batch_count)]
+        
+        # Convertir los lotes en paralelo (un proceso ffmpeg por lote)
+        self.log_message.emit(f"🚀 Iniciando conversión ({self.max_workers} procesos simultáneos)...")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.convert_batch, batch): batch for batch in batches}
             
-            # Evitar que el hilo consuma demasiados recursos
-            QThread.msleep(10)
+            remaining = set(futures)
+            stopped = False
+            unsaved = 0
+            while remaining:
+                done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+                
+                # Al detener se cancelan los lotes que no han empezado; los cancelados
+                # quedan terminados y el siguiente wait los devuelve sin esperar, y los
+                # que están en marcha acaban enseguida porque stop() interrumpe ffmpeg
+                if self.stop_requested and not stopped:
+                    self.log_message.emit("⚠️ Proceso de conversión detenido por el usuario.")
+                    for pending_future in remaining:
+                        pending_future.cancel()
+                    stopped = True
+                
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    
+                    converted_messages = []
+                    for (video_file, _), success in zip(futures[future], future.result()):
+                        # Las tareas que no llegaron a iniciarse no cuentan
+                        if success is None:
+                            continue
+                        
+                        if success:
+                            converted_messages.append(f"✅ Convertido: {os.path.basename(video_file)}")
+                            successful += 1
+                            
+                            # Registrar la conversión en la caché
+                            cache_key, cache_entry = cache_entries[video_file]
+                            if cache_entry:
+                                conversion_cache[cache_key] = cache_entry
+                                unsaved += 1
+                        else:
+                            failed += 1
+                        
+                        processed += 1
+                    
+                    # Mensajes del lote y progreso, una señal de cada uno por lote
+                    if converted_messages:
+                        self.log_messages.emit(converted_messages)
+                    self.progress_updated.emit(processed, total_files)
+                    
+                    # Guardar la caché periódicamente por si el proceso se interrumpe
+                    if unsaved >= self.CACHE_SAVE_INTERVAL:
+                        self.save_conversion_cache(conversion_cache)
+                        unsaved = 0
+            
+            if unsaved:
+                self.save_conversion_cache(conversion_cache)
         
         # Mostrar resultados
         self.log_message.emit("\n=== Resumen de Conversión ===")
@@ -111,81 +421,319 @@ class FFmpegWorker(QThread):
     
     def get_output_extension(self):
         """Obtiene la extensión de archivo según el formato de salida seleccionado."""
-        # Mapeo de formatos a extensiones
-        format_extensions = {
-            'wav': '.wav',
-            'wav_voice': '.wav',
-            'mp3': '.mp3',
-            'ogg': '.ogg',
-            'flac': '.flac',
-            'aac': '.aac',
-            'm4a': '.m4a',
-            'opus': '.opus',
-            'wma': '.wma'
+        return self.OUTPUT_EXTENSIONS.get(self.output_format, '.wav')
+    
+    def get_batch_size(self, file_count):
+        """Calcula cuántos archivos procesa cada invocación de ffmpeg."""
+        if file_count <= self.BATCH_MIN_FILES:
+            return 1
+        
+        # Repartir los archivos entre los procesos sin superar el límite por lote
+        per_worker = -(-file_count // self.max_workers)
+        return max(1, min(self.BATCH_MAX_FILES, per_worker))
+    
+    def find_existing_outputs(self, output_extension):
+        """Lista en una sola pasada los archivos de salida que ya existen.
+        
+        Devuelve un conjunto de rutas normalizadas para que la comprobación de
+        cada archivo sea una búsqueda en memoria en lugar de una llamada al sistema.
+        """
+        search_root = self.output_path or self.input_path
+        return {os.path.normcase(entry.path)
+                for _, entry in iter_video_entries(search_root, (output_extension,))}
+    
+    def get_cache_file(self):
+        """Obtiene la ruta del archivo de caché de conversiones."""
+        return os.path.join(self.output_path or self.input_path, self.CACHE_FILENAME)
+    
+    def load_conversion_cache(self):
+        """Carga la caché de conversiones anteriores (vacía si no existe o no es válida)."""
+        try:
+            with open(self.get_cache_file(), 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def save_conversion_cache(self, cache):
+        """Guarda la caché de conversiones de forma atómica."""
+        cache_file = self.get_cache_file()
+        temp_file = cache_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            self.log_message.emit(f"⚠️ No se pudo guardar la caché de conversiones: {str(e)}")
+    
+    def get_cache_entry(self, video_file, output_file, stat=None):
+        """Datos que identifican una conversión: origen (fecha y tamaño), salida y parámetros."""
+        # Reutilizar el stat obtenido al recorrer las carpetas si está disponible
+        if stat is None:
+            try:
+                stat = os.stat(video_file)
+            except OSError:
+                return None
+        
+        return {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'output': os.path.normcase(output_file),
+            'args': self.codec_args_key
         }
-        return format_extensions.get(self.output_format, '.wav')
     
-    def convert_audio(self, input_file, output_file):
-        """Convierte un archivo de video a audio con el formato especificado."""
+    def is_cache_entry_stale(self, cached_entry, cache_entry):
+        """Comprueba si la caché registra la misma salida con otro origen o parámetros.
+        
+        Sin entrada en la caché no se sabe de dónde salió el archivo, así que no
+        se considera desactualizado (se respeta como cualquier salida existente).
+        """
+        return (cached_entry is not None and cached_entry.get('output') == cache_entry['output']
+                and cached_entry != cache_entry)
+    
+    def is_output_newer(self, output_file, cache_entry):
+        """Comprueba si la salida existe y es posterior a la última modificación del origen."""
         try:
-            # Configuración base
-            command = ['ffmpeg', '-i', input_file, '-vn']
+            return os.stat(output_file).st_mtime_ns >= cache_entry['mtime']
+        except OSError:
+            return False
+    
+    def get_source_size(self, cache_entry):
+        """Obtiene el tamaño del archivo de origen a partir de su entrada de caché."""
+        return cache_entry['size'] if cache_entry else 0
+    
+    def get_output_file(self, video_file, output_extension):
+        """Calcula la ruta del archivo de salida como texto (no crea directorios)."""
+        base_path = os.path.splitext(video_file)[0]
+        if not self.output_path:
+            # Si no se especificó carpeta de salida, usar la misma que el archivo original
+            return base_path + output_extension
+        
+        # Calcular ruta de salida preservando la estructura de carpetas. Lo habitual
+        # es que el archivo esté dentro de la carpeta de entrada: basta con quitar el
+        # prefijo (normcase no cambia la longitud del texto)
+        if os.path.normcase(base_path).startswith(self.input_prefix):
+            rel_path = base_path[len(self.input_prefix):]
+        else:
+            try:
+                rel_path = os.path.relpath(base_path, self.input_path)
+            except ValueError:
+                # En Windows, el archivo está en otra unidad
+                rel_path = os.pardir
             
-            # Configurar el codec y parámetros según el formato seleccionado
-            if self.output_format == 'wav':
-                # WAV - PCM 16 bit con calidad completa (siempre estéreo)
-                command.extend(['-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2'])
-            elif self.output_format == 'wav_voice':
-                # WAV para transcripción de voz (siempre 16kHz mono)
-                command.extend(['-acodec', 'pcm_s16le', '-ar', '16000', '-ac', '1'])
-            elif self.output_format == 'mp3':
-                # MP3 con calidad variable
-                quality = self.get_mp3_quality()
-                command.extend(['-codec:a', 'libmp3lame', '-qscale:a', quality])
-            elif self.output_format == 'ogg':
-                # OGG Vorbis con calidad variable
-                quality = self.get_ogg_quality()
-                command.extend(['-codec:a', 'libvorbis', '-qscale:a', quality])
-            elif self.output_format == 'flac':
-                # FLAC con compresión variable
-                command.extend(['-codec:a', 'flac', '-compression_level', str(self.audio_quality)])
-            elif self.output_format == 'aac':
-                # AAC con bitrate variable
-                bitrate = self.get_aac_bitrate()
-                command.extend(['-codec:a', 'aac', '-b:a', bitrate])
-            elif self.output_format == 'm4a':
-                # M4A (AAC en contenedor MP4)
-                bitrate = self.get_aac_bitrate()
-                command.extend(['-codec:a', 'aac', '-b:a', bitrate])
-            elif self.output_format == 'opus':
-                # Opus con bitrate variable
-                bitrate = self.get_opus_bitrate()
-                command.extend(['-codec:a', 'libopus', '-b:a', bitrate])
-            elif self.output_format == 'wma':
-                # WMA con bitrate variable
-                bitrate = self.get_wma_bitrate()
-                command.extend(['-codec:a', 'wmav2', '-b:a', bitrate])
+            # Los archivos fuera de la carpeta de entrada van directamente a la de salida
+            if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+                rel_path = os.path.basename(base_path)
+        
+        return os.path.join(self.output_path, rel_path + output_extension)
+    
+    def convert_file(self, video_file, output_file, copy_audio=False):
+        """Convierte un archivo individual, o devuelve None si se solicitó detener."""
+        if self.stop_requested:
+            return None
+        
+        if copy_audio:
+            # El audio ya tiene el formato de destino: copiarlo sin recodificar
+            self.log_message.emit(f"⚡ Copiando audio sin recodificar: {os.path.basename(video_file)}")
+            return self.convert_audio(video_file, output_file, self.COPY_CODEC_ARGS)
+        
+        self.log_message.emit(f"🔄 Convirtiendo: {os.path.basename(video_file)}")
+        return self.convert_audio(video_file, output_file)
+    
+    def convert_batch(self, pairs):
+        """Tarea del pool: convierte un grupo de archivos.
+        
+        Devuelve una lista de resultados alineada con pairs (None si se solicitó detener).
+        """
+        if self.stop_requested:
+            return [None] * len(pairs)
+        
+        # Los archivos cuyo audio ya tiene el formato de destino se copian aparte
+        results = [None] * len(pairs)
+        to_convert = []
+        
+        # Lanzar las consultas de ffprobe del lote en paralelo: cada una es sobre
+        # todo espera (arranque del proceso y lectura de la cabecera)
+        video_files = [video_file for video_file, _ in pairs]
+        if len(pairs) > 1 and self.output_format in self.PCM_TARGETS and self.ffprobe_exe:
+            with ThreadPoolExecutor(max_workers=self.PROBE_WORKERS) as probe_executor:
+                copyable = list(probe_executor.map(self.can_copy_audio, video_files))
+        else:
+            copyable = [self.can_copy_audio(video_file) for video_file in video_files]
+        
+        for index, (video_file, output_file) in enumerate(pairs):
+            if copyable[index]:
+                results[index] = self.convert_file(video_file, output_file, copy_audio=True)
+            elif os.path.normcase(output_file) in self.replaced_outputs:
+                # -y/-n afectan a todas las salidas de un proceso: las que hay que
+                # reemplazar sin sobrescribir las demás se convierten por separado
+                results[index] = self.convert_file(video_file, output_file)
             else:
-                # Formato desconocido, usar WAV como fallback
-                command.extend(['-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2'])
+                to_convert.append(index)
+        
+        if len(to_convert) == 1:
+            results[to_convert[0]] = self.convert_file(*pairs[to_convert[0]])
+        elif to_convert:
+            converted = self.convert_multiple([pairs[index] for index in to_convert])
+            for index, success in zip(to_convert, converted):
+                results[index] = success
+        
+        return results
+    
+    def convert_multiple(self, pairs):
+        """Convierte varios archivos con una sola invocación de ffmpeg."""
+        self.log_messages.emit([f"🔄 Convirtiendo: {os.path.basename(video_file)}" for video_file, _ in pairs])
+        output_files = [output_file for _, output_file in pairs]
+        protected = self.find_protected_outputs(output_files)
+        
+        try:
+            # Una entrada por archivo y una salida por entrada, cada una con su stream de audio
+            command = [self.ffmpeg_exe, '-hide_banner', self.get_overwrite_flag()]
+            # -threads delante de cada -i limita los hilos de decodificación y,
+            # delante de cada salida, los de codificación; todas las entradas y salidas
+            # del lote se procesan a la vez, así que se reparten los hilos del proceso
+            threads = str(self.get_ffmpeg_threads(len(pairs)))
+            for video_file, _ in pairs:
+                command.extend(['-threads', threads, '-i', video_file])
             
-            # Agregar el archivo de salida y parámetros adicionales
-            command.extend([
-                output_file,
-                '-y' if self.overwrite_existing else '-n',
-                '-hide_banner', '-loglevel', 'warning'
-            ])
+            codec_args = self.codec_args
+            for index, (_, output_file) in enumerate(pairs):
+                command.extend(['-map', f'{index}:a:0', '-threads', threads, '-vn'])
+                command.extend(codec_args)
+                command.append(output_file)
             
-            # Ejecutar ffmpeg
+            returncode, _ = self.run_ffmpeg(command)
+            if returncode == 0:
+                return [True] * len(pairs)
+        except Exception as e:
+            self.log_message.emit(f"⚠️ Error en la conversión por lotes: {str(e)}")
+        
+        # Las salidas que el lote llegó a escribir pueden estar incompletas; se
+        # descartan para que no quede un archivo a medias de los que vuelvan a fallar
+        # en el reintento. Las que ya existían y ffmpeg no podía sobrescribir (-n)
+        # no son del lote y se conservan
+        self.remove_partial_outputs(output_files, protected)
+        
+        # Si el lote se interrumpió al detener la conversión, no se reintenta
+        if self.stop_requested:
+            return [None] * len(pairs)
+        
+        # ffmpeg aborta el lote completo si falla una entrada; repetir archivo por
+        # archivo para saber cuáles fallaron realmente
+        self.log_message.emit("⚠️ Falló la conversión por lotes, reintentando archivo por archivo...")
+        
+        return [self.convert_file(video_file, output_file) for video_file, output_file in pairs]
+    
+    def find_protected_outputs(self, output_files):
+        """Devuelve las salidas que ya existen y que ffmpeg no va a sobrescribir (-n).
+        
+        La lista de salidas existentes de run puede no incluirlas (aparecieron después,
+        o están en carpetas que no se recorren), así que se comprueba justo antes de
+        lanzar ffmpeg.
+        """
+        return {output_file for output_file in output_files
+                if self.get_overwrite_flag(output_file) == '-n' and os.path.exists(output_file)}
+    
+    def remove_partial_outputs(self, output_files, protected):
+        """Borra las salidas de un proceso fallido, salvo las que ya existían (protected)."""
+        for output_file in output_files:
+            if output_file in protected:
+                continue
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+    
+    def can_copy_audio(self, input_file):
+        """Comprueba con ffprobe si el audio ya está en el formato WAV de destino."""
+        target = self.PCM_TARGETS.get(self.output_format)
+        if target is None or not self.ffprobe_exe:
+            return False
+        
+        # Solo merece la pena lanzar ffprobe en contenedores que suelen llevar PCM
+        if not input_file.lower().endswith(self.PCM_CONTAINERS):
+            return False
+        
+        try:
             result = subprocess.run(
-                command,
+                [self.ffprobe_exe, '-v', 'error', '-select_streams', 'a:0',
+                 '-show_entries', 'stream=codec_name,sample_rate,channels',
+                 '-of', 'json', input_file],
+                stdin=subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
+                stderr=subprocess.DEVNULL,
+                close_fds=CLOSE_FDS,
+                creationflags=CREATE_NO_WINDOW
             )
+            streams = json.loads(result.stdout or b'{}').get('streams') or []
+            if not streams:
+                return False
             
-            if result.returncode != 0:
-                self.log_message.emit(f"❌ Error al convertir {input_file}: {result.stderr}")
+            stream = streams[0]
+            return (stream.get('codec_name'), int(stream.get('sample_rate', 0)),
+                    stream.get('channels')) == target
+        except (OSError, ValueError):
+            return False
+    
+    def get_codec_args(self):
+        """Obtiene los parámetros de codec de ffmpeg según el formato seleccionado."""
+        if self.output_format == 'wav':
+            # WAV - PCM 16 bit con calidad completa (siempre estéreo)
+            return ['-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2']
+        elif self.output_format == 'wav_voice':
+            # WAV para transcripción de voz (siempre 16kHz mono)
+            return ['-acodec', 'pcm_s16le', '-ar', '16000', '-ac', '1']
+        elif self.output_format == 'mp3':
+            # MP3 con calidad variable
+            return ['-codec:a', 'libmp3lame', '-qscale:a', self.get_mp3_quality()]
+        elif self.output_format == 'ogg':
+            # OGG Vorbis con calidad variable
+            return ['-codec:a', 'libvorbis', '-qscale:a', self.get_ogg_quality()]
+        elif self.output_format == 'flac':
+            # FLAC con compresión variable
+            return ['-codec:a', 'flac', '-compression_level', str(self.audio_quality)]
+        elif self.output_format == 'aac':
+            # AAC con bitrate variable
+            return ['-codec:a', 'aac', '-b:a', self.get_aac_bitrate()]
+        elif self.output_format == 'm4a':
+            # M4A (AAC en contenedor MP4)
+            return ['-codec:a', 'aac', '-b:a', self.get_aac_bitrate()]
+        elif self.output_format == 'opus':
+            # Opus con bitrate variable
+            return ['-codec:a', 'libopus', '-b:a', self.get_opus_bitrate()]
+        elif self.output_format == 'wma':
+            # WMA con bitrate variable
+            return ['-codec:a', 'wmav2', '-b:a', self.get_wma_bitrate()]
+        
+        # Formato desconocido, usar WAV como fallback
+        return ['-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2']
+    
+    def convert_audio(self, input_file, output_file, codec_args=None):
+        """Convierte un archivo de video a audio con el formato especificado."""
+        try:
+            # Configuración base (-threads antes de -i para la decodificación y
+            # después para la codificación). Con -vn el stream de video no se
+            # decodifica (solo se leen sus paquetes), así que -hwaccel no aportaría nada
+            threads = str(self.get_ffmpeg_threads())
+            command = [self.ffmpeg_exe, '-hide_banner', self.get_overwrite_flag(output_file),
+                       '-threads', threads, '-i', input_file, '-threads', threads, '-vn']
+            
+            # Configurar el codec y parámetros según el formato seleccionado
+            command.extend(codec_args or self.codec_args)
+            
+            # Agregar el archivo de salida
+            command.append(output_file)
+            
+            # Ejecutar ffmpeg
+            protected = self.find_protected_outputs([output_file])
+            returncode, stderr = self.run_ffmpeg(command)
+            if returncode != 0 and self.stop_requested:
+                # Interrumpido al detener la conversión: descartar la salida a medias
+                # (si no existía ya antes de lanzar ffmpeg)
+                self.remove_partial_outputs([output_file], protected)
+                return None
+            if returncode != 0:
+                self.log_message.emit(f"❌ Error al convertir {input_file}: {stderr.decode('utf-8', errors='replace')}")
                 return False
             
             return True
@@ -193,112 +741,205 @@ class FFmpegWorker(QThread):
             self.log_message.emit(f"❌ Error al convertir {input_file}: {str(e)}")
             return False
     
+    def run_ffmpeg(self, command):
+        """Ejecuta ffmpeg informando del progreso; devuelve (código de salida, stderr en bytes)."""
+        # ffmpeg escribe el progreso en stdout (-progress pipe:1) y el registro en
+        # stderr con el nivel de cada línea, para leer la duración de cada entrada
+        # de las líneas [info] y conservar el resto para el mensaje de error
+        command = command[:1] + ['-progress', 'pipe:1', '-nostats', '-loglevel', 'level+info'] + command[1:]
+        durations = []
+        stderr_tail = deque(maxlen=self.STDERR_TAIL_LINES)
+        with subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,  # ffmpeg no debe esperar teclas por la entrada estándar
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            close_fds=CLOSE_FDS,
+            creationflags=CREATE_NO_WINDOW
+        ) as process:
+            # Registrar el proceso para que stop() pueda interrumpirlo; si ya se pidió
+            # detener antes de registrarlo, interrumpirlo aquí
+            with self.process_lock:
+                self.processes.add(process)
+                if self.stop_requested:
+                    process.terminate()
+            
+            try:
+                # stderr se lee en otro hilo a medida que se produce para que ffmpeg
+                # nunca se bloquee con uno de los dos pipes lleno
+                reader = threading.Thread(target=self.read_ffmpeg_log,
+                                          args=(process.stderr, stderr_tail, durations), daemon=True)
+                reader.start()
+                
+                for line in process.stdout:
+                    # out_time_us es el tiempo procesado en microsegundos (las versiones
+                    # antiguas solo escriben out_time_ms, que también está en microsegundos)
+                    if line.startswith((b'out_time_us=', b'out_time_ms=')):
+                        try:
+                            out_time = int(line[12:]) / 1000000
+                        except ValueError:
+                            continue
+                        fraction = sum(min(1.0, out_time / duration) for duration in durations if duration)
+                        self.report_partial_progress(fraction)
+                
+                returncode = process.wait()
+                reader.join()
+            finally:
+                with self.process_lock:
+                    self.processes.discard(process)
+        
+        self.report_partial_progress(None)
+        return returncode, b''.join(stderr_tail)
+    
+    def read_ffmpeg_log(self, stream, stderr_tail, durations):
+        """Lee el registro de ffmpeg: guarda la duración de cada entrada y el final del resto."""
+        for line in stream:
+            level = LOG_LEVEL_PATTERN.match(line)
+            if level and level.group(2) == b'info':
+                match = DURATION_PATTERN.search(line)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    durations.append(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+                elif b'Duration: N/A' in line:
+                    durations.append(None)
+            elif level:
+                # Quitar la etiqueta de nivel para que el error se lea como sin level+
+                stderr_tail.append(level.group(1) + line[level.end():])
+            else:
+                stderr_tail.append(line)
+    
+    def report_partial_progress(self, fraction):
+        """Registra cuánto lleva convertido el proceso de este hilo (None al terminar).
+        
+        Emite la suma de todos los procesos en curso, como mucho cada
+        PARTIAL_PROGRESS_INTERVAL segundos salvo al terminar un proceso.
+        """
+        key = threading.get_ident()
+        with self.progress_lock:
+            if fraction is None:
+                self.partial_fractions.pop(key, None)
+            else:
+                self.partial_fractions[key] = fraction
+                now = time.monotonic()
+                if now - self.last_partial_emit < self.PARTIAL_PROGRESS_INTERVAL:
+                    return
+                self.last_partial_emit = now
+            total = sum(self.partial_fractions.values())
+        self.partial_progress.emit(total)
+    
+    def get_overwrite_flag(self, output_file=None):
+        """Obtiene la opción de ffmpeg para las salidas que ya existen.
+        
+        Sin sobrescribir, las salidas existentes ya se omitieron en run (salvo las de
+        replaced_outputs); -n hace que ffmpeg falle en vez de reemplazar una que haya
+        aparecido después.
+        """
+        if self.overwrite_existing or (output_file and os.path.normcase(output_file) in self.replaced_outputs):
+            return '-y'
+        return '-n'
+    
+    def get_ffmpeg_threads(self, streams=1):
+        """Obtiene el número de hilos por entrada/salida de ffmpeg para no saturar la CPU.
+        
+        streams es el número de archivos que convierte a la vez el mismo proceso
+        (lotes); los hilos del proceso se reparten entre ellos.
+        """
+        if self.ffmpeg_threads > 0:
+            total = self.ffmpeg_threads
+        else:
+            # Repartir los núcleos entre los procesos simultáneos (hilos totales ≈ núcleos)
+            total = (os.cpu_count() or 2) // max(1, self.max_workers)
+        
+        return max(1, total // max(1, streams))
+    
     def get_mp3_quality(self):
         """Obtiene el valor de calidad para MP3 según el nivel seleccionado."""
-        # MP3 quality: 0 (mejor) a 9 (peor)
-        quality_map = {
-            0: '0',  # Mejor calidad
-            1: '2',
-            2: '4',
-            3: '6',
-            4: '9'   # Calidad más baja
-        }
-        return quality_map.get(self.audio_quality, '2')
+        return self.MP3_QUALITY.get(self.audio_quality, '2')
     
     def get_ogg_quality(self):
         """Obtiene el valor de calidad para OGG Vorbis según el nivel seleccionado."""
-        # OGG quality: 0 (peor) a 10 (mejor)
-        quality_map = {
-            0: '10',  # Mejor calidad
-            1: '8',
-            2: '6',
-            3: '3',
-            4: '1'    # Calidad más baja
-        }
-        return quality_map.get(self.audio_quality, '6')
+        return self.OGG_QUALITY.get(self.audio_quality, '6')
     
     def get_aac_bitrate(self):
         """Obtiene el bitrate para AAC según el nivel seleccionado."""
-        # AAC bitrates
-        bitrate_map = {
-            0: '256k',  # Mejor calidad
-            1: '192k',
-            2: '128k',
-            3: '96k',
-            4: '64k'    # Calidad más baja
-        }
-        return bitrate_map.get(self.audio_quality, '128k')
+        return self.AAC_BITRATES.get(self.audio_quality, '128k')
     
     def get_opus_bitrate(self):
         """Obtiene el bitrate para Opus según el nivel seleccionado."""
-        # Opus bitrates
-        bitrate_map = {
-            0: '192k',  # Mejor calidad
-            1: '128k',
-            2: '96k',
-            3: '64k',
-            4: '32k'    # Calidad más baja
-        }
-        return bitrate_map.get(self.audio_quality, '96k')
+        return self.OPUS_BITRATES.get(self.audio_quality, '96k')
     
     def get_wma_bitrate(self):
         """Obtiene el bitrate para WMA según el nivel seleccionado."""
-        # WMA bitrates
-        bitrate_map = {
-            0: '256k',  # Mejor calidad
-            1: '192k',
-            2: '128k',
-            3: '96k',
-            4: '64k'    # Calidad más baja
-        }
-        return bitrate_map.get(self.audio_quality, '128k')
+        return self.WMA_BITRATES.get(self.audio_quality, '128k')
 
     def stop(self):
-        """Detiene la ejecución del hilo"""
-        self.stop_requested = True
+        """Detiene la ejecución del hilo e interrumpe los procesos ffmpeg en marcha.
+        
+        Cada proceso puede estar convirtiendo un lote entero, así que no basta con
+        no lanzar más: sin interrumpirlos habría que esperar a que terminen sus archivos.
+        """
+        with self.process_lock:
+            self.stop_requested = True
+            for process in self.processes:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass  # Ya había terminado
 
+    def iter_video_files(self, folder, video_exts):
+        """Devuelve (ruta, stat) de cada video de la carpeta (y subcarpetas si es recursivo)."""
+        for _, entry in iter_video_entries(folder, video_exts, self.recursive, self.log_scan_error):
+            yield entry.path, entry.stat()
+    
+    def log_scan_error(self, folder, error):
+        """Registra una carpeta que no se pudo leer durante la búsqueda."""
+        self.log_message.emit(f"⚠️ No se pudo leer la carpeta {folder}: {str(error)}")
+    
+    def produce_video_files(self, video_queue):
+        """Productor: encola los videos encontrados y al final None como centinela."""
+        try:
+            for item in self.find_video_files():
+                if self.stop_requested:
+                    break
+                video_queue.put(item)
+        except Exception as e:
+            self.log_message.emit(f"❌ Error al buscar archivos de video: {str(e)}")
+        finally:
+            video_queue.put(None)
+    
     def find_video_files(self):
-        """Encuentra archivos de video según los filtros y selecciones"""
-        video_files = []
+        """Encuentra archivos de video según los filtros y selecciones.
+        
+        Genera tuplas (ruta como texto, stat); stat es None si no se conoce.
+        """
+        # Si el árbol de la interfaz ya recorrió las carpetas con los mismos filtros,
+        # usar su lista en lugar de volver a leer todo el disco
+        if self.prescanned_files is not None:
+            for file_path in self.prescanned_files:
+                yield file_path, None
+            return
+        
         selected_folders = self.selected_items['folders']
         selected_files = self.selected_items['files']
         
-        # Primero añadir los archivos individuales seleccionados
+        # Primero añadir los archivos individuales seleccionados (sin stat previo)
         for file_path in selected_files:
-            video_files.append(Path(file_path))
+            yield file_path, None
         
-        # Luego procesar las carpetas seleccionadas
+        # Luego procesar las carpetas seleccionadas con un único recorrido por carpeta;
+        # los archivos ya entregados se comprueban en un conjunto, no en la lista
+        selected_file_set = frozenset(selected_files)
         for folder in selected_folders:
             # Verificar si la carpeta existe
             if not os.path.exists(folder):
                 continue
+            
+            for file_path, stat in self.iter_video_files(folder, self.video_exts):
+                # Verificar si el archivo ya fue añadido como selección individual
+                if file_path in selected_file_set:
+                    continue
                 
-            # Si la búsqueda es recursiva
-            if self.recursive:
-                for root, _, files in os.walk(folder):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # Verificar si el archivo ya fue añadido como selección individual
-                        if file_path in selected_files:
-                            continue
-                            
-                        ext = os.path.splitext(file)[1].lower()
-                        if ext in self.selected_formats:
-                            video_files.append(Path(file_path))
-            # Si la búsqueda no es recursiva, solo buscar en la carpeta actual
-            else:
-                for file in os.listdir(folder):
-                    file_path = os.path.join(folder, file)
-                    # Verificar si el archivo ya fue añadido como selección individual
-                    if file_path in selected_files:
-                        continue
-                        
-                    if os.path.isfile(file_path):
-                        ext = os.path.splitext(file)[1].lower()
-                        if ext in self.selected_formats:
-                            video_files.append(Path(file_path))
-        
-        return video_files
+                yield file_path, stat
 
 
 class FolderScannerThread(QThread):
@@ -358,8 +999,129 @@ class FolderScannerThread(QThread):
             self.log_message.emit(f"Error durante el escaneo: {str(e)}")
 
 
+class FolderTreeThread(QThread):
+    """Hilo que lee el contenido de las carpetas que se muestran en el árbol"""
+    # Señales
+    listing_complete = pyqtSignal(object)  # {carpeta: (subcarpetas, videos)}
+    log_message = pyqtSignal(str)  # Mensaje de registro
+    
+    # Carpetas que se leen a la vez
+    SCAN_WORKERS = min(8, (os.cpu_count() or 4) * 2)
+    
+    def __init__(self, root_path, video_exts, recursive, show_empty, folder_cache, cache_exts,
+                 parent=None):
+        super().__init__(parent)
+        self.root_path = root_path
+        self.video_exts = video_exts  # Tupla de extensiones, apta para endswith
+        self.recursive = recursive
+        self.show_empty = show_empty
+        # Caché compartida entre lecturas: {carpeta: (mtime, subcarpetas, videos)}, con
+        # los videos de cualquiera de cache_exts para servir a todas las selecciones
+        self.folder_cache = folder_cache
+        self.cache_exts = cache_exts
+        self.stop_requested = False
+    
+    def run(self):
+        try:
+            listings = self.read_folder_listings()
+            if self.stop_requested:
+                return
+            
+            if self.recursive and not self.show_empty:
+                self.prune_empty_folders(listings)
+            self.listing_complete.emit(listings)
+        except Exception as e:
+            self.log_message.emit(f"❌ Error al buscar archivos: {str(e)}")
+    
+    def stop(self):
+        """Detiene la lectura (se comprueba antes de leer cada carpeta)"""
+        self.stop_requested = True
+    
+    def read_folder_listings(self):
+        """Lee la carpeta raíz (y sus subcarpetas si es recursivo) con varios hilos.
+        
+        Devuelve {carpeta: (subcarpetas, videos)}, con listas de (nombre, ruta).
+        """
+        listings = {}
+        with ThreadPoolExecutor(max_workers=self.SCAN_WORKERS) as executor:
+            pending = {executor.submit(self.list_folder, self.root_path)}
+            while pending:
+                # Una lectura sustituida por otra más reciente deja de leer carpetas
+                if self.stop_requested:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder, subfolders, files, error = future.result()
+                    if error is not None:
+                        self.log_message.emit(f"⚠️ Error al escanear {folder}: {str(error)}")
+                    listings[folder] = (subfolders, files)
+                    
+                    # Cada carpeta leída añade sus subcarpetas al pool
+                    if self.recursive:
+                        for _, subfolder in subfolders:
+                            pending.add(executor.submit(self.list_folder, subfolder))
+        return listings
+    
+    def prune_empty_folders(self, listings):
+        """Quita de las listas de subcarpetas las que no tienen videos en todo su contenido"""
+        # Cada carpeta se lee después que su padre, así que en orden inverso las
+        # subcarpetas se procesan antes que la carpeta que las contiene
+        has_videos = {}
+        for folder in reversed(listings):
+            subfolders, files = listings[folder]
+            kept = [(name, path) for name, path in subfolders if has_videos.get(path)]
+            if len(kept) != len(subfolders):
+                listings[folder] = (kept, files)
+            has_videos[folder] = bool(files or kept)
+        
+        # Las carpetas descartadas ya no se muestran ni se recorren
+        for folder, found in has_videos.items():
+            if not found:
+                del listings[folder]
+    
+    def list_folder(self, folder):
+        """Tarea del pool: lee una carpeta; devuelve (carpeta, subcarpetas, videos, error).
+        
+        Si la fecha de modificación de la carpeta no cambió desde la última lectura
+        (crear, borrar o renombrar algo dentro la cambia), se usa la caché con una
+        sola llamada a stat en lugar de volver a recorrerla.
+        """
+        subfolders = []
+        files = []
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            cached = self.folder_cache.get(folder)
+            if cached is None or cached[0] != mtime:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        # No seguir enlaces simbólicos a carpetas (igual que la conversión)
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name.lower() not in SKIPPED_FOLDERS:
+                                subfolders.append((entry.name, entry.path))
+                        elif entry.name.lower().endswith(self.cache_exts) and entry.is_file():
+                            files.append((entry.name, entry.path))
+                cached = (mtime, subfolders, files)
+                self.folder_cache[folder] = cached
+        except OSError as e:
+            return folder, subfolders, files, e
+        
+        _, subfolders, files = cached
+        if self.video_exts != self.cache_exts:
+            files = [(name, path) for name, path in files if name.lower().endswith(self.video_exts)]
+        return folder, subfolders, files, None
+
+
 class VidToWav(QMainWindow):
     """Aplicación para convertir archivos de video a audio con PyQt5"""
+    # Intervalo de volcado del registro y número máximo de líneas conservadas
+    LOG_FLUSH_INTERVAL_MS = 100
+    LOG_MAX_LINES = 5000
+    
+    # Resolución de la barra de progreso (permite avanzar dentro de cada archivo)
+    PROGRESS_BAR_SCALE = 1000
+    
     def __init__(self):
         super().__init__()
         
@@ -372,6 +1134,14 @@ class VidToWav(QMainWindow):
         self.output_folder = ""
         self.conversion_running = False
         self.worker_thread = None
+        self.scanner_thread = None  # Lectura de carpetas en curso para el árbol
+        self.pending_tree_scan_key = None  # Filtros de la lectura en curso
+        
+        # Caché de la detección de ffmpeg: rutas absolutas de los ejecutables y
+        # PATH con el que se buscaron (None = aún no comprobado)
+        self.ffmpeg_exe = None
+        self.ffprobe_exe = None
+        self._ffmpeg_path_env = None
         
         # Lista extendida de formatos de video soportados por ffmpeg
         self.video_formats = [
@@ -396,17 +1166,35 @@ class VidToWav(QMainWindow):
         
         # Variables para los checkboxes de formatos
         self.format_checkboxes = {}
+        self.selected_formats = ()  # Formatos marcados, actualizados al cambiar un checkbox
+        self.formats_rescan_pending = False  # Actualización del árbol ya programada
         
         # Variables para el árbol de carpetas
-        self.folder_items = {}  # Para acceder rápidamente a los elementos del árbol
         self.file_items = {}  # Para almacenar referencias a los items de archivo
-        
-        # Configuración de la interfaz
+        self.pending_check_changes = []  # Cambios de selección aún no registrados
+        self.tree_scan_key = None  # Filtros con los que se construyó el árbol
+        self.tree_recursive = True  # Si el árbol muestra las subcarpetas
+        self.folder_listings = {}  # Contenido leído de cada carpeta del árbol
+        self.folder_cache = {}  # Contenido de las carpetas ya leídas, para las siguientes lecturas
+        self.unloaded_folders = set()  # Carpetas cuyo contenido aún no se ha creado en el árbol
+        self.selected_items_cache = None  # Selección del árbol, hasta que cambie alguna marca
+        self.saved_tree_state = None  # Marcas y carpetas expandidas a restaurar al reconstruir
+        
+        # Registro y progreso: los mensajes y el último valor de progreso se acumulan
+        # y se vuelcan en bloque periódicamente para no redibujar con cada señal de los hilos
+        self.log_buffer = []
+        self.log_line_count = 0  # Mensajes volcados desde la última limpieza del registro
+        self.progress_files = (0, 0)
+        self.progress_partial = 0.0
+        self.progress_dirty = False
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(self.LOG_FLUSH_INTERVAL_MS)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.timeout.connect(self.flush_progress)
+        self.log_timer.start()
+        
+        # Configuración de la interfaz (también comprueba ffmpeg una vez al inicio)
         self.setup_ui()
-        
-        # Verificar ffmpeg al inicio
-        QApplication.processEvents()
-        self.check_ffmpeg()
     
     def setup_ui(self):
         """Configura la interfaz de usuario"""
@@ -476,6 +1264,7 @@ class VidToWav(QMainWindow):
         self.folder_tree.setHeaderLabels(["Nombre"])
         self.folder_tree.setColumnWidth(0, 300)
         self.folder_tree.itemChanged.connect(self.on_tree_item_changed)
+        self.folder_tree.itemExpanded.connect(self.on_tree_item_expanded)
         tree_layout.addWidget(self.folder_tree)
         
         # Botones para seleccionar/deseleccionar
@@ -543,11 +1332,56 @@ class VidToWav(QMainWindow):
         self.recursive_checkbox.stateChanged.connect(self.on_recursive_changed)
         options_layout.addWidget(self.recursive_checkbox)
         
+        # Mostrar en el árbol las carpetas sin videos de los formatos seleccionados
+        self.show_empty_checkbox = QCheckBox("Mostrar carpetas vacías")
+        self.show_empty_checkbox.setChecked(False)
+        self.show_empty_checkbox.setToolTip("Muestra también las carpetas que no contienen videos "
+                                            "de los formatos seleccionados (ni en sus subcarpetas)")
+        self.show_empty_checkbox.stateChanged.connect(self.on_show_empty_changed)
+        options_layout.addWidget(self.show_empty_checkbox)
+        
         # Sobrescribir archivos existentes
         self.overwrite_checkbox = QCheckBox("Sobrescribir archivos existentes")
         self.overwrite_checkbox.setChecked(False)
         options_layout.addWidget(self.overwrite_checkbox)
         
+        # Omitir archivos ya convertidos que no han cambiado (caché de conversiones)
+        self.skip_unchanged_checkbox = QCheckBox("Omitir archivos sin cambios desde la última conversión")
+        self.skip_unchanged_checkbox.setChecked(True)
+        self.skip_unchanged_checkbox.setToolTip("Usa la caché de la carpeta de salida: sin sobrescribir, omite los archivos "
+                                                "que no han cambiado y vuelve a convertir los que cambiaron "
+                                                "desde la última conversión")
+        options_layout.addWidget(self.skip_unchanged_checkbox)
+        
+        # Omitir salidas más recientes que el video original (al sobrescribir)
+        self.skip_newer_checkbox = QCheckBox("Omitir archivos cuya salida es más reciente que el original")
+        self.skip_newer_checkbox.setChecked(False)
+        self.skip_newer_checkbox.setToolTip("Al sobrescribir, no vuelve a convertir los videos cuyo archivo de audio "
+                                            "se creó después de la última modificación del video")
+        options_layout.addWidget(self.skip_newer_checkbox)
+        
+        # Número de conversiones simultáneas (procesos ffmpeg en paralelo)
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Conversiones simultáneas:"))
+        self.max_workers_spinbox = QSpinBox()
+        self.max_workers_spinbox.setMinimum(1)
+        self.max_workers_spinbox.setMaximum(max(1, (os.cpu_count() or 1) * 2))
+        self.max_workers_spinbox.setValue(DEFAULT_MAX_WORKERS)
+        self.max_workers_spinbox.setToolTip("Número de archivos que se convierten a la vez")
+        workers_layout.addWidget(self.max_workers_spinbox)
+        
+        # Hilos por proceso ffmpeg (0 = automático)
+        workers_layout.addWidget(QLabel("Hilos por proceso:"))
+        self.ffmpeg_threads_spinbox = QSpinBox()
+        self.ffmpeg_threads_spinbox.setMinimum(0)
+        self.ffmpeg_threads_spinbox.setMaximum(max(1, os.cpu_count() or 1))
+        self.ffmpeg_threads_spinbox.setValue(0)
+        self.ffmpeg_threads_spinbox.setSpecialValueText("Automático")
+        self.ffmpeg_threads_spinbox.setToolTip("Hilos de ffmpeg por proceso, repartidos entre los archivos de cada lote (Automático reparte los núcleos entre los procesos)")
+        workers_layout.addWidget(self.ffmpeg_threads_spinbox)
+        workers_layout.addStretch()
+        options_layout.addLayout(workers_layout)
+        
         # Formato de salida seleccionado (vista rápida)
         format_layout = QHBoxLayout()
         format_layout.addWidget(QLabel("Formato de salida:"))
@@ -562,7 +1396,7 @@ class VidToWav(QMainWindow):
         right_layout.addLayout(actions_layout)
         
         self.scan_button = QPushButton("Escanear Carpeta")
-        self.scan_button.clicked.connect(self.scan_files)
+        self.scan_button.clicked.connect(self.rescan_input_folder)
         actions_layout.addWidget(self.scan_button)
         
         self.start_button = QPushButton("Iniciar Conversión")
@@ -587,9 +1421,10 @@ class VidToWav(QMainWindow):
         
         log_layout = QVBoxLayout(log_group)
         
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setFont(QFont("Consolas", 9))
+        self.log_text.setMaximumBlockCount(self.LOG_MAX_LINES)
         log_layout.addWidget(self.log_text)
         
         # Añadir los paneles al splitter
@@ -617,11 +1452,14 @@ class VidToWav(QMainWindow):
             
             checkbox = QCheckBox(fmt)
             checkbox.setChecked(True)
+            checkbox.stateChanged.connect(self.update_selected_formats)
             formats_layout.addWidget(checkbox, row, col)
             
             # Guardar referencia al checkbox
             self.format_checkboxes[fmt] = checkbox
         
+        self.update_selected_formats()
+        
         # Botones para seleccionar/deseleccionar todos
         buttons_layout = QHBoxLayout()
         layout.addLayout(buttons_layout)
@@ -728,6 +1566,7 @@ class VidToWav(QMainWindow):
         if folder:
             self.input_folder = folder
             self.input_folder_label.setText(folder)
+            self.folder_cache = {}  # Las carpetas leídas de la selección anterior ya no se usan
             self.log_message(f"📁 Carpeta de entrada: {folder}")
             
             # Si no hay carpeta de salida, usar la misma
@@ -736,8 +1575,10 @@ class VidToWav(QMainWindow):
                 self.output_folder_label.setText(folder)
                 
             # Limpiar el registro si hay demasiadas entradas
-            if self.log_text.document().lineCount() > 200:
+            self.flush_log()
+            if self.log_line_count > 200:
                 self.log_text.clear()
+                self.log_line_count = 0
                 self.log_message("🔄 Registro limpiado por rendimiento")
                 self.log_message(f"📁 Carpeta de entrada: {folder}")
             
@@ -753,20 +1594,36 @@ class VidToWav(QMainWindow):
             self.log_message(f"📁 Carpeta de salida: {folder}")
     
     def log_message(self, message):
-        """Agrega un mensaje al área de registro"""
-        self.log_text.append(message)
-        # Desplazar al final
-        cursor = self.log_text.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        self.log_text.setTextCursor(cursor)
+        """Agrega un mensaje al área de registro (se muestra en el próximo volcado)"""
+        self.log_buffer.append(message)
+    
+    def log_messages(self, messages):
+        """Agrega varios mensajes de una vez al área de registro"""
+        self.log_buffer.extend(messages)
+    
+    def flush_log(self):
+        """Vuelca los mensajes pendientes al área de registro con una sola inserción"""
+        if not self.log_buffer:
+            return
+        
+        text = "\n".join(self.log_buffer)
+        self.log_line_count += len(self.log_buffer)
+        self.log_buffer.clear()
+        # Texto plano sin maquetación HTML; si la vista ya estaba al final,
+        # QPlainTextEdit se desplaza solo hasta la última línea
+        self.log_text.appendPlainText(text)
     
     def on_recursive_changed(self, state):
         """Maneja el cambio en la opción de búsqueda recursiva"""
         if self.input_folder:
             # Actualizar árbol según el nuevo estado
-            self.update_folder_tree()
             self.scan_files()
     
+    def on_show_empty_changed(self, state):
+        """Vuelve a construir el árbol al mostrar u ocultar las carpetas vacías"""
+        if self.input_folder:
+            self.rescan_keeping_tree_state()
+    
     def select_all_formats(self, select):
         """Selecciona o deselecciona todos los formatos de video"""
         for checkbox in self.format_checkboxes.values():
@@ -778,153 +1635,398 @@ class VidToWav(QMainWindow):
             self.log_message("Se han deseleccionado todos los formatos de video")
     
     def get_selected_formats(self):
-        """Obtiene los formatos de video seleccionados"""
-        return [fmt for fmt, checkbox in self.format_checkboxes.items() if checkbox.isChecked()]
+        """Obtiene los formatos de video seleccionados (tupla, sin consultar los checkboxes)"""
+        return self.selected_formats
+    
+    def update_selected_formats(self):
+        """Recalcula los formatos seleccionados cuando cambia algún checkbox"""
+        self.selected_formats = tuple(fmt for fmt, checkbox in self.format_checkboxes.items()
+                                      if checkbox.isChecked())
+        
+        # El árbol se vuelve a construir una sola vez aunque cambien muchos checkboxes
+        # seguidos (p. ej. "Seleccionar todos"); las carpetas sin cambios salen de la caché
+        if self.input_folder and not self.formats_rescan_pending:
+            self.formats_rescan_pending = True
+            QTimer.singleShot(0, self.on_formats_changed)
+    
+    def on_formats_changed(self):
+        """Actualiza el árbol con los formatos seleccionados"""
+        self.formats_rescan_pending = False
+        if self.input_folder and self.get_tree_scan_key() != self.pending_tree_scan_key:
+            self.rescan_keeping_tree_state()
+    
+    def rescan_keeping_tree_state(self):
+        """Vuelve a leer el árbol con los filtros actuales conservando marcas y carpetas expandidas"""
+        # Si la lectura anterior aún no había terminado, el árbol está vacío y se
+        # conserva el estado que ya se había guardado de él
+        if self.tree_scan_key is not None:
+            state = self.save_tree_state()
+        else:
+            state = self.saved_tree_state
+        self.scan_files()
+        self.saved_tree_state = state
+    
+    def save_tree_state(self):
+        """Devuelve las marcas de los videos y carpetas y las carpetas expandidas, por ruta."""
+        file_states = {}
+        folder_states = {}
+        expanded = set()
+        iterator = QTreeWidgetItemIterator(self.folder_tree)
+        while iterator.value():
+            item = iterator.value()
+            iterator += 1
+            path = item.data(0, Qt.UserRole)
+            if path is None:  # Elemento provisional
+                continue
+            
+            check_state = item.checkState(0)
+            if path in self.file_items:
+                file_states[path] = check_state
+                continue
+            
+            folder_states[path] = check_state
+            if item.isExpanded():
+                expanded.add(path)
+            
+            # Los videos de las carpetas sin expandir tienen todos el estado de la carpeta
+            if path in self.unloaded_folders:
+                for file_path in self.iter_unloaded_files(path):
+                    file_states[file_path] = check_state
+        return file_states, folder_states, expanded
+    
+    def restore_tree_state(self, item, state, default_state=Qt.Checked):
+        """Aplica a una carpeta del árbol recién construido el estado guardado con save_tree_state.
+        
+        Las carpetas cuyo contenido tiene una sola marca se marcan de una vez sin crear
+        sus elementos; solo se rellenan las que mezclan marcas o estaban expandidas.
+        Los videos nuevos (p. ej. de un formato recién marcado) toman la marca que
+        tenía su carpeta si era completa.
+        """
+        file_states, folder_states, expanded = state
+        folder_path = item.data(0, Qt.UserRole)
+        if folder_states.get(folder_path) in (Qt.Checked, Qt.Unchecked):
+            default_state = folder_states[folder_path]
+        
+        wanted = {file_states.get(file_path, default_state) for file_path in self.iter_unloaded_files(folder_path)}
+        if len(wanted) == 1:
+            item.setCheckState(0, wanted.pop())
+        if len(wanted) <= 1 and folder_path not in expanded:
+            return
+        
+        self.load_folder_item(item)
+        for i in range(item.childCount()):
+            child = item.child(i)
+            path = child.data(0, Qt.UserRole)
+            if path in self.file_items:
+                child.setCheckState(0, file_states.get(path, default_state))
+            elif path is not None:
+                self.restore_tree_state(child, state, default_state)
+        item.setExpanded(folder_path in expanded)
     
     def on_tree_item_changed(self, item, column):
         """Maneja el cambio de estado de selección de un elemento del árbol"""
+        self.selected_items_cache = None
         if column == 0:
             # Solo registrar cambios en elementos de archivo, no en carpetas
             if item.data(0, Qt.UserRole) in self.file_items:
                 check_state = item.checkState(0)
-                if check_state == Qt.Checked:
-                    self.log_message(f"Seleccionado: {item.text(0)}")
-                elif check_state == Qt.Unchecked:
-                    self.log_message(f"Deseleccionado: {item.text(0)}")
+                if check_state in (Qt.Checked, Qt.Unchecked):
+                    # Al marcar una carpeta Qt propaga el estado a todos sus archivos de
+                    # golpe: se agrupan los cambios y se registran una sola vez
+                    if not self.pending_check_changes:
+                        QTimer.singleShot(0, self.report_check_changes)
+                    self.pending_check_changes.append((item.text(0), check_state))
+    
+    def report_check_changes(self):
+        """Registra los cambios de selección acumulados (uno a uno solo si son pocos)"""
+        changes = self.pending_check_changes
+        self.pending_check_changes = []
+        
+        if len(changes) == 1:
+            name, check_state = changes[0]
+            if check_state == Qt.Checked:
+                self.log_message(f"Seleccionado: {name}")
+            else:
+                self.log_message(f"Deseleccionado: {name}")
+            return
+        
+        checked = sum(1 for _, check_state in changes if check_state == Qt.Checked)
+        unchecked = len(changes) - checked
+        if checked:
+            self.log_message(f"Seleccionados: {checked} archivos")
+        if unchecked:
+            self.log_message(f"Deseleccionados: {unchecked} archivos")
     
     def select_all_items(self):
         """Selecciona todos los elementos del árbol"""
-        root = self.folder_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            item = root.child(i)
-            item.setCheckState(0, Qt.Checked)
+        self.set_all_items_check_state(Qt.Checked)
         self.log_message("Se han seleccionado todos los elementos")
         
     def deselect_all_items(self):
         """Deselecciona todos los elementos del árbol"""
-        root = self.folder_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            item = root.child(i)
-            item.setCheckState(0, Qt.Unchecked)
+        self.set_all_items_check_state(Qt.Unchecked)
         self.log_message("Se han deseleccionado todos los elementos")
     
+    def set_all_items_check_state(self, check_state):
+        """Marca o desmarca todo el árbol sin emitir itemChanged por cada elemento"""
+        # Qt propaga el estado a los hijos (ItemIsAutoTristate); con las señales
+        # bloqueadas no se llama a on_tree_item_changed una vez por archivo, y sin
+        # actualizaciones la vista se repinta una sola vez al final
+        self.selected_items_cache = None
+        self.folder_tree.setUpdatesEnabled(False)
+        self.folder_tree.blockSignals(True)
+        try:
+            root = self.folder_tree.invisibleRootItem()
+            for i in range(root.childCount()):
+                item = root.child(i)
+                # Si ya está en ese estado, todo su contenido también lo está
+                if item.checkState(0) != check_state:
+                    item.setCheckState(0, check_state)
+        finally:
+            self.folder_tree.blockSignals(False)
+            self.folder_tree.setUpdatesEnabled(True)
+    
     def update_folder_tree(self):
-        """Actualiza el árbol de carpetas con la estructura de la carpeta seleccionada"""
+        """Vacía el árbol y empieza a leer la carpeta seleccionada en segundo plano.
+        
+        El árbol se construye en on_folder_listing_complete cuando termina la lectura,
+        sin bloquear la interfaz mientras se recorren las carpetas.
+        """
         self.folder_tree.clear()
-        self.folder_items = {}
         self.file_items = {}
+        self.folder_listings = {}
+        self.unloaded_folders = set()
+        self.selected_items_cache = None
+        self.saved_tree_state = None
+        self.tree_scan_key = None
+        
+        # Una lectura anterior que aún no ha terminado ya no se usa
+        if self.scanner_thread is not None:
+            self.scanner_thread.stop()
+            self.scanner_thread = None
         
         if not self.input_folder:
             return
-            
-        # Crear elemento raíz
+        
+        # Filtros con los que se construye el árbol: mientras no cambien, la lista de
+        # archivos del árbol se pasa al proceso de conversión sin volver a buscarlos
+        self.pending_tree_scan_key = self.get_tree_scan_key()
+        self.tree_recursive = self.recursive_checkbox.isChecked()
+        
+        # El hilo pertenece a la ventana (y se libera al terminar), así que una lectura
+        # sustituida por otra puede acabar por su cuenta sin guardar referencias
+        self.scanner_thread = FolderTreeThread(self.input_folder, self.get_selected_formats(),
+                                               self.tree_recursive, self.show_empty_checkbox.isChecked(),
+                                               self.folder_cache, tuple(sorted(self.video_formats)), self)
+        self.scanner_thread.listing_complete.connect(self.on_folder_listing_complete)
+        self.scanner_thread.log_message.connect(self.log_message)
+        self.scanner_thread.finished.connect(self.scanner_thread.deleteLater)
+        
+        self.start_button.setEnabled(False)
+        self.statusBar().showMessage("Buscando archivos de video...")
+        self.scanner_thread.start()
+    
+    def on_folder_listing_complete(self, listings):
+        """Construye el árbol con el contenido leído y muestra el recuento de videos"""
+        # Ignorar los resultados de una lectura ya sustituida por otra
+        if self.sender() is not self.scanner_thread:
+            return
+        self.scanner_thread = None
+        self.statusBar().showMessage("Listo")
+        
+        self.folder_listings = listings
+        self.tree_scan_key = self.pending_tree_scan_key
+        
+        # Crear elemento raíz (sin padre: el árbol se construye fuera del widget
+        # y se inserta de una vez, en lugar de repintar con cada elemento)
         root_path = self.input_folder
         root_name = os.path.basename(root_path) or root_path
-        root_item = QTreeWidgetItem(self.folder_tree)
+        root_item = QTreeWidgetItem()
         root_item.setText(0, root_name)
         root_item.setIcon(0, self.style().standardIcon(QStyle.SP_DirIcon))
         root_item.setData(0, Qt.UserRole, root_path)
         root_item.setFlags(root_item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsAutoTristate)
         root_item.setCheckState(0, Qt.Checked)
         
-        self.folder_items[root_path] = root_item
+        self.icons = (self.style().standardIcon(QStyle.SP_DirIcon),
+                      self.style().standardIcon(QStyle.SP_FileIcon))
+        self.add_folder_contents(root_path, root_item, Qt.Checked)
         
-        # Si la búsqueda es recursiva, usar scan_subfolders que ya escanea la carpeta actual
-        if self.recursive_checkbox.isChecked():
-            self.scan_subfolders(root_path, root_item)
-        else:
-            # Si no es recursiva, sólo escanear la carpeta raíz
-            self.scan_files_in_folder(root_path, root_item)
+        # Insertar el árbol completo sin repintar ni emitir itemChanged por cada elemento
+        self.folder_tree.setUpdatesEnabled(False)
+        self.folder_tree.blockSignals(True)
+        try:
+            self.folder_tree.addTopLevelItem(root_item)
             
-        # Expandir elemento raíz
-        root_item.setExpanded(True)
+            # Al cambiar los filtros se recuperan las marcas y carpetas expandidas
+            # del árbol anterior; si no, se expande el elemento raíz
+            if self.saved_tree_state is not None:
+                state = self.saved_tree_state
+                self.saved_tree_state = None
+                state[2].add(root_path)
+                self.restore_tree_state(root_item, state)
+            else:
+                root_item.setExpanded(True)
+        finally:
+            self.folder_tree.blockSignals(False)
+            self.folder_tree.setUpdatesEnabled(True)
+        
+        self.report_scan_results()
     
-    def scan_subfolders(self, parent_path, parent_item):
-        """Escanea las subcarpetas de forma recursiva"""
-        try:
-            # Primero agregar los archivos de la carpeta actual
-            self.scan_files_in_folder(parent_path, parent_item)
+    def get_tree_scan_key(self):
+        """Devuelve los filtros de los que depende el contenido del árbol"""
+        return (self.input_folder, self.get_selected_formats(), self.recursive_checkbox.isChecked())
+    
+    def add_folder_contents(self, folder_path, parent_item, check_state):
+        """Crea los elementos de los videos y subcarpetas directas de una carpeta.
+        
+        Las subcarpetas con contenido reciben un elemento provisional y se rellenan
+        al expandirlas (on_tree_item_expanded): solo se crean los elementos que se
+        llegan a ver, aunque la selección y el recuento abarcan todo lo leído.
+        """
+        subfolders, files = self.folder_listings.get(folder_path, ((), ()))
+        dir_icon, file_icon = self.icons
+        
+        # Primero agregar los archivos de la carpeta actual
+        file_items = []
+        for file_name, file_path in files:
+            # Crear elemento de archivo
+            file_item = QTreeWidgetItem()
+            file_item.setText(0, file_name)
+            file_item.setIcon(0, file_icon)
+            file_item.setData(0, Qt.UserRole, file_path)
+            file_item.setFlags(file_item.flags() | Qt.ItemIsUserCheckable)
+            file_item.setCheckState(0, check_state)
             
-            # Luego procesar subcarpetas
-            for entry in os.scandir(parent_path):
-                if entry.is_dir():
-                    child_path = entry.path
-                    child_name = os.path.basename(child_path)
-                    
-                    # Crear elemento hijo
-                    child_item = QTreeWidgetItem(parent_item)
-                    child_item.setText(0, child_name)
-                    child_item.setIcon(0, self.style().standardIcon(QStyle.SP_DirIcon))
-                    child_item.setData(0, Qt.UserRole, child_path)
-                    child_item.setFlags(child_item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsAutoTristate)
-                    child_item.setCheckState(0, Qt.Checked)
-                    
-                    self.folder_items[child_path] = child_item
-                    
-                    # Continuar escaneando de forma recursiva
-                    self.scan_subfolders(child_path, child_item)
-        except Exception as e:
-            self.log_message(f"⚠️ Error al escanear subcarpetas: {str(e)}")
+            # Guardar referencia al elemento de archivo
+            self.file_items[file_path] = file_item
+            file_items.append(file_item)
+        parent_item.addChildren(file_items)
+        
+        # Luego las subcarpetas, solo si la búsqueda es recursiva
+        if not self.tree_recursive:
+            return
+        
+        child_items = []
+        for child_name, child_path in subfolders:
+            # Crear elemento hijo (se añaden al padre al final, todos juntos)
+            child_item = QTreeWidgetItem()
+            child_item.setText(0, child_name)
+            child_item.setIcon(0, dir_icon)
+            child_item.setData(0, Qt.UserRole, child_path)
+            child_item.setFlags(child_item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsAutoTristate)
+            child_item.setCheckState(0, check_state)
+            
+            # Elemento provisional para que aparezca la flecha de expandir. Lleva el
+            # estado de la carpeta porque Qt lo calcula a partir de sus hijos
+            child_subfolders, child_files = self.folder_listings.get(child_path, ((), ()))
+            if child_subfolders or child_files:
+                placeholder = QTreeWidgetItem()
+                placeholder.setText(0, "...")
+                placeholder.setCheckState(0, check_state)
+                child_item.addChild(placeholder)
+                self.unloaded_folders.add(child_path)
+            
+            child_items.append(child_item)
+        parent_item.addChildren(child_items)
     
-    def scan_files_in_folder(self, folder_path, parent_item):
-        """Escanea y agrega archivos de video a la carpeta especificada en el árbol"""
+    def on_tree_item_expanded(self, item):
+        """Crea el contenido de una carpeta la primera vez que se expande"""
+        if item.data(0, Qt.UserRole) not in self.unloaded_folders:
+            return
+        
+        self.folder_tree.setUpdatesEnabled(False)
+        self.folder_tree.blockSignals(True)
         try:
-            # Obtener formatos de video seleccionados
-            selected_formats = self.get_selected_formats()
-            
-            # Escanear archivos en la carpeta
-            for entry in os.scandir(folder_path):
-                if entry.is_file():
-                    file_path = entry.path
-                    file_name = os.path.basename(file_path)
-                    ext = os.path.splitext(file_name)[1].lower()
-                    
-                    # Verificar si es un formato de video seleccionado
-                    if ext in selected_formats:
-                        # Crear elemento de archivo
-                        file_item = QTreeWidgetItem(parent_item)
-                        file_item.setText(0, file_name)
-                        file_item.setIcon(0, self.style().standardIcon(QStyle.SP_FileIcon))
-                        file_item.setData(0, Qt.UserRole, file_path)
-                        file_item.setFlags(file_item.flags() | Qt.ItemIsUserCheckable)
-                        file_item.setCheckState(0, Qt.Checked)
-                        
-                        # Guardar referencia al elemento de archivo
-                        self.file_items[file_path] = file_item
-        except Exception as e:
-            self.log_message(f"⚠️ Error al escanear archivos: {str(e)}")
+            self.load_folder_item(item)
+        finally:
+            self.folder_tree.blockSignals(False)
+            self.folder_tree.setUpdatesEnabled(True)
+    
+    def load_folder_item(self, item):
+        """Sustituye el elemento provisional de una carpeta por su contenido (si no se creó ya)"""
+        folder_path = item.data(0, Qt.UserRole)
+        if folder_path not in self.unloaded_folders:
+            return
+        self.unloaded_folders.discard(folder_path)
+        self.selected_items_cache = None
+        
+        # Los nuevos elementos heredan el estado actual de la carpeta
+        check_state = item.checkState(0)
+        item.takeChildren()
+        self.add_folder_contents(folder_path, item, check_state)
+    
+    def iter_unloaded_files(self, folder_path):
+        """Genera las rutas de los videos de una carpeta aún no expandida (y sus subcarpetas)"""
+        pending_folders = [folder_path]
+        while pending_folders:
+            subfolders, files = self.folder_listings.get(pending_folders.pop(), ((), ()))
+            for _, file_path in files:
+                yield file_path
+            pending_folders.extend(subfolder for _, subfolder in subfolders)
     
     def get_selected_items(self):
-        """Obtiene las carpetas y archivos seleccionados en el árbol"""
+        """Obtiene las carpetas y archivos seleccionados en el árbol.
+        
+        El resultado se guarda hasta que cambia alguna marca o el contenido del árbol,
+        de modo que buscar archivos e iniciar la conversión no recorren el árbol dos veces.
+        """
+        if self.selected_items_cache is not None:
+            return self.selected_items_cache
+        
         result = {
             'folders': [],
             'files': []
         }
         
-        # Recorrer elementos de carpeta
-        for folder_path, item in self.folder_items.items():
-            if item.checkState(0) == Qt.Checked:
-                result['folders'].append(folder_path)
-        
-        # Recorrer elementos de archivo
-        for file_path, item in self.file_items.items():
-            if item.checkState(0) == Qt.Checked:
-                result['files'].append(file_path)
+        # Recorrer solo los elementos marcados con el iterador de Qt (su filtro Checked
+        # también incluye las carpetas marcadas en parte); los que no son archivos
+        # son carpetas
+        iterator = QTreeWidgetItemIterator(self.folder_tree, QTreeWidgetItemIterator.Checked)
+        while iterator.value():
+            item = iterator.value()
+            iterator += 1
+            if item.checkState(0) != Qt.Checked:
+                continue
+            
+            path = item.data(0, Qt.UserRole)
+            if path in self.file_items:
+                result['files'].append(path)
+            elif path is not None:  # Los elementos provisionales no tienen ruta
+                result['folders'].append(path)
+                
+                # Los videos de las carpetas sin expandir no tienen elemento propio
+                if path in self.unloaded_folders:
+                    result['files'].extend(self.iter_unloaded_files(path))
         
+        self.selected_items_cache = result
         return result
     
+    def rescan_input_folder(self):
+        """Botón "Escanear Carpeta": vuelve a leer todas las carpetas sin usar la caché.
+        
+        La caché se valida con la fecha de modificación de cada carpeta, que en algunos
+        sistemas de archivos (FAT, unidades de red) no cambia de forma fiable; la
+        lectura explícita la descarta. Los cambios de filtros siguen usándola.
+        """
+        self.folder_cache = {}
+        self.scan_files()
+    
     def scan_files(self):
-        """Busca archivos de video en la carpeta de entrada"""
+        """Busca archivos de video en la carpeta de entrada (el resultado llega al terminar)"""
         if not self.input_folder:
             return
-            
-        # Obtener formatos seleccionados
-        selected_formats = self.get_selected_formats()
         
         try:
             # Actualizar árbol de carpetas (esto ya escanea los archivos)
             self.update_folder_tree()
-            
+        except Exception as e:
+            self.log_message(f"❌ Error al buscar archivos: {str(e)}")
+            self.start_button.setEnabled(False)
+    
+    def report_scan_results(self):
+        """Muestra cuántos videos hay seleccionados en el árbol recién construido"""
+        try:
             # Contar archivos usando las selecciones actuales
             selected_items = self.get_selected_items()
             total_files = len(selected_items['files'])
@@ -943,16 +2045,27 @@ class VidToWav(QMainWindow):
             self.start_button.setEnabled(False)
     
     def check_ffmpeg(self):
-        """Verifica si ffmpeg está instalado en el sistema"""
-        try:
-            subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        """Verifica si ffmpeg está instalado en el sistema (la ruta se guarda en caché)"""
+        # Solo volver a buscarlo si cambió el PATH desde la última vez
+        path_env = os.environ.get('PATH', '')
+        if self._ffmpeg_path_env == path_env:
+            if not self.ffmpeg_exe:
+                self.log_message("❌ Error: ffmpeg no está instalado o no está en el PATH.")
+            return self.ffmpeg_exe is not None
+        
+        # shutil.which busca el ejecutable sin lanzar un proceso; la ruta absoluta
+        # se pasa a los hilos de conversión para no volver a resolverla en cada archivo
+        self._ffmpeg_path_env = path_env
+        self.ffmpeg_exe = shutil.which('ffmpeg')
+        self.ffprobe_exe = shutil.which('ffprobe')
+        
+        if self.ffmpeg_exe:
             self.log_message("✅ ffmpeg detectado correctamente.")
-            return True
-        except FileNotFoundError:
+        else:
             self.log_message("❌ Error: ffmpeg no está instalado o no está en el PATH.")
             QMessageBox.critical(self, "Error", "ffmpeg no está instalado o no está en el PATH.\n"
                                "Por favor, instala ffmpeg y asegúrate de que esté en el PATH.")
-            return False
+        return self.ffmpeg_exe is not None
     
     def start_conversion(self):
         """Inicia el proceso de conversión de archivos"""
@@ -980,6 +2093,11 @@ class VidToWav(QMainWindow):
             QMessageBox.warning(self, "Advertencia", "No hay carpetas ni archivos seleccionados para convertir")
             return
         
+        # Reutilizar los archivos encontrados al construir el árbol si sigue al día
+        prescanned_files = None
+        if self.tree_scan_key == self.get_tree_scan_key():
+            prescanned_files = selected_items['files']
+        
         # Obtener formato de audio seleccionado
         output_format = self.output_format_combo.currentData()
         if not output_format:
@@ -996,6 +2114,9 @@ class VidToWav(QMainWindow):
         self.stop_button.setEnabled(True)
         
         # Resetear barra de progreso
+        self.progress_files = (0, 0)
+        self.progress_partial = 0.0
+        self.progress_dirty = False
         self.progress_bar.setValue(0)
         
         # Iniciar hilo de conversión
@@ -1007,13 +2128,22 @@ class VidToWav(QMainWindow):
             self.recursive_checkbox.isChecked(), 
             self.overwrite_checkbox.isChecked(),
             output_format,
-            audio_quality
+            audio_quality,
+            self.max_workers_spinbox.value(),
+            self.ffmpeg_threads_spinbox.value(),
+            self.skip_unchanged_checkbox.isChecked(),
+            self.ffmpeg_exe,
+            self.ffprobe_exe,
+            prescanned_files,
+            self.skip_newer_checkbox.isChecked()
         )
         
         # Conectar señales
         self.worker_thread.progress_updated.connect(self.update_progress)
+        self.worker_thread.partial_progress.connect(self.update_partial_progress)
         self.worker_thread.conversion_finished.connect(self.conversion_finished)
         self.worker_thread.log_message.connect(self.log_message)
+        self.worker_thread.log_messages.connect(self.log_messages)
         
         # Iniciar hilo
         self.worker_thread.start()
@@ -1021,21 +2151,42 @@ class VidToWav(QMainWindow):
     def stop_conversion(self):
         """Detiene el proceso de conversión"""
         if self.worker_thread and self.worker_thread.isRunning():
-            self.worker_thread.stop_requested = True
+            self.worker_thread.stop()
             self.log_message("⏹️ Deteniendo el proceso de conversión...")
             self.stop_button.setEnabled(False)
     
     def update_progress(self, current, total):
-        """Actualiza la barra de progreso"""
-        self.progress_bar.setMaximum(total)
-        self.progress_bar.setValue(current)
-        self.progress_bar.setFormat(f"{current}/{total} ({int(current/total*100)}%)")
+        """Guarda los archivos terminados; la barra se actualiza en el próximo volcado"""
+        self.progress_files = (current, total)
+        self.progress_dirty = True
+    
+    def update_partial_progress(self, partial):
+        """Guarda la fracción convertida de los archivos que están en curso"""
+        self.progress_partial = partial
+        self.progress_dirty = True
+    
+    def flush_progress(self):
+        """Aplica a la barra de progreso el último valor recibido (una vez por intervalo)"""
+        if not self.progress_dirty:
+            return
+        
+        self.progress_dirty = False
+        current, total = self.progress_files
+        if not total:
+            return
+        
+        # La barra avanza también dentro de cada archivo según el tiempo convertido
+        done = min(total, current + self.progress_partial)
+        self.progress_bar.setMaximum(self.PROGRESS_BAR_SCALE)
+        self.progress_bar.setValue(int(done / total * self.PROGRESS_BAR_SCALE))
+        self.progress_bar.setFormat(f"{current}/{total} ({int(done/total*100)}%)")
     
     def conversion_finished(self):
         """Maneja el evento de finalización de la conversión"""
         self.conversion_running = False
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
+        self.flush_progress()
         self.progress_bar.setValue(self.progress_bar.maximum())
         
         # Reproducir sonido de notificación si está disponible
@@ -1046,20 +2197,29 @@ class VidToWav(QMainWindow):
             
         self.log_message("✅ Proceso de conversión finalizado")
         
-        # Preguntar si quiere abrir la carpeta de salida
+        # Preguntar si quiere abrir la carpeta de salida. El aviso no es modal y no
+        # espera la respuesta: la interfaz sigue funcionando mientras está abierto
         if self.output_folder and os.path.exists(self.output_folder):
-            reply = QMessageBox.question(
-                self, 
+            message_box = QMessageBox(
+                QMessageBox.Question,
                 "Conversión Completada", 
                 "El proceso de conversión ha finalizado. ¿Desea abrir la carpeta de salida?",
                 QMessageBox.Yes | QMessageBox.No, 
-                QMessageBox.Yes
+                self
             )
-            
-            if reply == QMessageBox.Yes:
-                self.open_output_folder()
+            message_box.setDefaultButton(QMessageBox.Yes)
+            message_box.finished.connect(self.on_finished_message_closed)
         else:
-            QMessageBox.information(self, "Conversión Completada", "El proceso de conversión ha finalizado.")
+            message_box = QMessageBox(QMessageBox.Information, "Conversión Completada",
+                                      "El proceso de conversión ha finalizado.", QMessageBox.Ok, self)
+        message_box.setAttribute(Qt.WA_DeleteOnClose)
+        message_box.setWindowModality(Qt.NonModal)
+        message_box.show()
+    
+    def on_finished_message_closed(self, result):
+        """Abre la carpeta de salida si se respondió que sí al aviso de finalización"""
+        if result == QMessageBox.Yes:
+            self.open_output_folder()
 
     def on_output_format_changed(self, index):
         """Actualiza los radio buttons cuando cambia el formato en el combobox"""
@@ -1099,16 +2259,34 @@ class VidToWav(QMainWindow):
     def open_folder_in_explorer(self, folder_path):
         """Abre una carpeta en el explorador de archivos del sistema"""
         try:
+            # Sin esperar a que termine el programa que abre la carpeta (xdg-open puede
+            # tardar en volver), para no bloquear la interfaz
             if sys.platform == 'win32':
                 os.startfile(folder_path)
             elif sys.platform == 'darwin':  # macOS
-                subprocess.run(['open', folder_path])
+                subprocess.Popen(['open', folder_path], stdin=subprocess.DEVNULL, close_fds=CLOSE_FDS)
             else:  # Linux y otros
-                subprocess.run(['xdg-open', folder_path])
+                subprocess.Popen(['xdg-open', folder_path], stdin=subprocess.DEVNULL, close_fds=CLOSE_FDS)
             self.log_message(f"📂 Abriendo carpeta: {folder_path}")
         except Exception as e:
             self.log_message(f"❌ Error al abrir la carpeta: {str(e)}")
             QMessageBox.warning(self, "Error", f"No se pudo abrir la carpeta: {str(e)}")
+    
+    def closeEvent(self, event):
+        """Detiene la conversión y las lecturas de carpetas en curso antes de cerrar la ventana"""
+        # Qt no permite destruir un QThread en marcha; stop() también interrumpe los
+        # procesos ffmpeg, que si no seguirían convirtiendo tras cerrar
+        if self.worker_thread is not None and self.worker_thread.isRunning():
+            # Sin aviso de finalización para una ventana que se está cerrando
+            self.worker_thread.conversion_finished.disconnect(self.conversion_finished)
+            self.worker_thread.stop()
+            self.worker_thread.wait()
+        
+        # Los hilos de lectura pertenecen a la ventana
+        for thread in self.findChildren(FolderTreeThread):
+            thread.stop()
+            thread.wait()
+        super().closeEvent(event)
 
 
 def main():